@@ -2,10 +2,28 @@ import streamlit as st
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
+import plotly.io as pio
+import pyarrow as pa
+import pyarrow.csv as pacsv
 import requests
+import glob
 import io
+import logging
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from datetime import datetime, timedelta
-from xml.etree import ElementTree as ET
+from email.utils import formatdate
+try:
+    from lxml import etree as ET
+    HAS_LXML = True
+except ImportError:
+    from xml.etree import ElementTree as ET
+    HAS_LXML = False
 from fpdf import FPDF
 from bs4 import BeautifulSoup
 
@@ -236,58 +254,277 @@ tab_bancar, tab_cursuri, tab_comunicate = st.tabs([
 # FUNCȚII CURSURI VALUTARE
 # ─────────────────────────────────────────────
 
-def get_exchange_rate(date_str):
-    url = f"https://www.bnm.md/en/official_exchange_rates?get_xml=1&date={date_str}"
+BNM_RATES_URL = "https://www.bnm.md/en/official_exchange_rates?get_xml=1&date={}"
+BNM_FETCH_WORKERS = 16
+RATES_CACHE_DB = "cache.db"
+RATES_SNAPSHOT_DIR = "cache"
+TODAY_RATES_TTL = 300
+BNM_TIMEOUT = (3.05, 10)  # (conectare, citire) în secunde
+
+_rates_db_local = threading.local()
+logger = logging.getLogger(__name__)
+
+
+def _rates_db():
+    """Conexiune SQLite per fir de execuție către cache-ul persistent al cursurilor."""
+    conn = getattr(_rates_db_local, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect(RATES_CACHE_DB, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS rates("
+            "date TEXT PRIMARY KEY, xml BLOB, fetched_at INTEGER)"
+        )
+        _rates_db_local.conn = conn
+    return conn
+
+
+@st.cache_resource
+def _bnm_session():
+    """Sesiune HTTP comună tuturor rulărilor, ca pool-ul de conexiuni TLS să fie refolosit."""
+    session = requests.Session()
+    session.mount('https://', HTTPAdapter(
+        pool_connections=32,
+        pool_maxsize=32,
+        max_retries=Retry(total=2, backoff_factor=0.2)
+    ))
+    return session
+
+
+def _fetch_uncached(date_str):
+    conn = _rates_db()
+    row = conn.execute(
+        "SELECT xml, fetched_at FROM rates WHERE date=?", (date_str,)
+    ).fetchone()
+    # Cursurile din zilele trecute nu se mai schimbă; doar ziua curentă expiră
+    is_today = date_str == datetime.now().strftime("%d.%m.%Y")
+    if row and (not is_today or time.time() - row[1] < TODAY_RATES_TTL):
+        return row[0]
+
     try:
-        response = requests.get(url, timeout=10)
-        if response.status_code == 200:
-            return response.content
+        return _fetch_and_store(conn, date_str, row)
     except Exception as e:
-        st.warning(f"Eroare la încărcarea datelor pentru {date_str}: {e}")
-    return None
+        if row is None:
+            raise
+        # Revalidarea a eșuat, dar avem deja XML-ul de azi salvat
+        logger.warning("Revalidarea cursului BNM pentru %s a eșuat, se folosește copia salvată: %s",
+                       date_str, e)
+        return row[0]
+
+
+def _fetch_and_store(conn, date_str, row):
+    # Pentru un rând expirat cerem doar modificările; la 304 păstrăm XML-ul salvat
+    headers = {}
+    if row:
+        headers['If-Modified-Since'] = formatdate(row[1], usegmt=True)
+    response = _bnm_session().get(BNM_RATES_URL.format(date_str), headers=headers, timeout=BNM_TIMEOUT)
+    if response.status_code == 304 and row:
+        with conn:
+            conn.execute(
+                "UPDATE rates SET fetched_at=? WHERE date=?",
+                (int(time.time()), date_str)
+            )
+        return row[0]
+    if response.status_code == 200:
+        # Rândurile din trecut nu expiră, deci salvăm doar un răspuns XML de la BNM.
+        # Un <ValCurs> gol (zi nelucrătoare) e valid și se păstrează.
+        if not _is_bnm_xml(response.content):
+            raise ValueError("Răspunsul BNM nu este un XML cu cursuri valutare")
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO rates(date, xml, fetched_at) VALUES (?, ?, ?)",
+                (date_str, response.content, int(time.time()))
+            )
+        return response.content
+    # Excepțiile nu sunt păstrate în st.cache_data, deci ziua va fi reîncercată
+    raise requests.HTTPError(
+        f"BNM a răspuns cu codul {response.status_code}", response=response
+    )
+
+
+@st.cache_data(ttl=None, show_spinner=False)
+def _get_past_exchange_rate(date_str):
+    return parse_xml(_fetch_uncached(date_str))
+
+
+@st.cache_data(ttl=TODAY_RATES_TTL, show_spinner=False)
+def _get_today_exchange_rate(date_str):
+    return parse_xml(_fetch_uncached(date_str))
+
+
+def get_exchange_rate(date):
+    """Cursurile parsate din trecut sunt păstrate permanent, cel de azi expiră după TODAY_RATES_TTL."""
+    date_str = date.strftime("%d.%m.%Y")
+    if date.date() < datetime.now().date():
+        return _get_past_exchange_rate(date_str)
+    return _get_today_exchange_rate(date_str)
+
+def _iter_valute(xml_content):
+    """Parcurge elementele <Valute> în flux, fără a construi tot arborele."""
+    if HAS_LXML:
+        for _, elem in ET.iterparse(io.BytesIO(xml_content), events=('end',),
+                                    tag='Valute', recover=True):
+            yield elem
+            # Eliberează nodurile deja procesate ca memoria să rămână constantă
+            elem.clear()
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+    else:
+        for _, elem in ET.iterparse(io.BytesIO(xml_content), events=('end',)):
+            if elem.tag == 'Valute':
+                yield elem
+                elem.clear()
+
+def _is_bnm_xml(xml_content):
+    """Verifică doar elementul rădăcină (<ValCurs>), fără a parcurge tot documentul."""
+    try:
+        for _, elem in ET.iterparse(io.BytesIO(xml_content), events=('start',)):
+            return elem.tag == 'ValCurs'
+    except Exception:
+        pass
+    return False
+
+_VALUTE_FIELDS = frozenset({'CharCode', 'Name', 'Value', 'Nominal'})
 
 def parse_xml(xml_content):
     rates = {}
     try:
-        root = ET.fromstring(xml_content)
-        for valute in root.findall('Valute'):
-            code = valute.find('CharCode').text
-            name = valute.find('Name').text
-            value = float(valute.find('Value').text)
-            nominal = int(valute.find('Nominal').text)
-            rates[code] = {
-                'name': name,
-                'value': value / nominal,
+        for valute in _iter_valute(xml_content):
+            # O singură trecere prin copii, în loc de câte un find pentru fiecare câmp
+            fields = {child.tag: child.text for child in valute
+                      if child.tag in _VALUTE_FIELDS}
+            nominal = int(fields['Nominal'])
+            rates[fields['CharCode']] = {
+                'name': fields['Name'],
+                'value': float(fields['Value']) / nominal,
                 'nominal': nominal
             }
     except Exception:
         pass
     return rates
 
-@st.cache_data(ttl=3600)
+def _rates_snapshot_path(end_date, days):
+    return os.path.join(RATES_SNAPSHOT_DIR, f"{end_date:%Y%m%d}_{days}.parquet")
+
+@st.cache_data(ttl=TODAY_RATES_TTL)
 def get_historical_data(days=30):
-    data = []
     end_date = datetime.now()
-    for i in range(0, days, 1):
-        date = end_date - timedelta(days=i)
-        date_str = date.strftime("%d.%m.%Y")
-        xml_content = get_exchange_rate(date_str)
-        if xml_content:
-            rates = parse_xml(xml_content)
-            if rates:
-                for code, info in rates.items():
-                    data.append({
-                        'Data': date.date(),
-                        'Cod': code,
-                        'Moneda': info['name'],
-                        'Curs': info['value']
-                    })
-    if data:
-        df = pd.DataFrame(data)
-        df['Data'] = pd.to_datetime(df['Data'])
-        df = df.sort_values('Data', ascending=True)
-        return df
-    return pd.DataFrame()
+    # BNM nu publică cursuri noi sâmbăta și duminica, deci nu le mai cerem
+    dates = [end_date - timedelta(days=i) for i in range(days)]
+    dates = [date for date in dates if date.weekday() < 5]
+
+    # Snapshot-ul Parquet conține doar zilele trecute, care nu se mai schimbă,
+    # deci e valabil toată ziua; doar cursul de azi se reîmprospătează
+    snapshot = _rates_snapshot_path(end_date, days)
+    try:
+        past_df = pd.read_parquet(snapshot)
+        dates = [date for date in dates if date.date() == end_date.date()]
+    except Exception:
+        past_df = None
+
+    # Coloanele se construiesc direct, fără o listă intermediară de dict-uri
+    dates_col, code_col, curs_col = [], [], []
+    fetch_failed = False
+
+    # Cererile către BNM sunt limitate de rețea, deci le trimitem în paralel
+    with ThreadPoolExecutor(max_workers=BNM_FETCH_WORKERS) as ex:
+        futures = {
+            ex.submit(get_exchange_rate, date): date
+            for date in dates
+        }
+        for future in as_completed(futures):
+            date = futures[future]
+            try:
+                rates = future.result()
+            except Exception as e:
+                st.warning(f"Eroare la încărcarea datelor pentru {date.strftime('%d.%m.%Y')}: {e}")
+                fetch_failed = True
+                continue
+            # Zilele fără cursuri (ex. sărbători) nu sunt erori, doar lipsesc din grafic
+            if not rates:
+                continue
+            dates_col.extend([date.date()] * len(rates))
+            code_col.extend(rates.keys())
+            curs_col.extend(info['value'] for info in rates.values())
+
+    df = pd.DataFrame({
+        'Data': pd.to_datetime(dates_col),
+        'Cod': pd.Categorical(code_col),
+        'Curs': pd.array(curs_col, dtype='float64'),
+    })
+    if past_df is None and not fetch_failed:
+        try:
+            os.makedirs(RATES_SNAPSHOT_DIR, exist_ok=True)
+            tmp_path = f"{snapshot}.{os.getpid()}.{threading.get_ident()}.tmp"
+            df[df['Data'].dt.date < end_date.date()].to_parquet(tmp_path, compression='zstd')
+            os.replace(tmp_path, snapshot)
+            # Doar snapshot-ul zilei curente e citit, celelalte pentru perioada asta se șterg
+            for old_path in glob.glob(os.path.join(RATES_SNAPSHOT_DIR, f"*_{days}.parquet")):
+                if old_path != snapshot:
+                    os.remove(old_path)
+        except Exception:
+            pass
+    if past_df is not None:
+        df = pd.concat([past_df, df], ignore_index=True)
+        df['Cod'] = df['Cod'].astype('category')
+
+    if df.empty:
+        return pd.DataFrame()
+    df = df.sort_values('Data', ascending=True)
+    # Identifică generația datelor; cache-urile derivate sunt indexate după ea
+    df.attrs['version'] = time.time()
+    return df
+
+@st.cache_data(max_entries=64)
+def filter_and_pivot(_df, days, currencies, version):
+    """Filtrează monedele selectate și pregătește tabelul pivot și CSV-ul (cache per selecție)."""
+    # _df nu intră în cheia de cache; version leagă rezultatul de generația datelor
+    df = _df
+    # Cod e categorial, deci isin compară doar categoriile, apoi filtrează pe coduri
+    df_filtered = df[df['Cod'].isin(currencies)].copy()
+    df_filtered['Cod'] = df_filtered['Cod'].cat.remove_unused_categories()
+    df_filtered = df_filtered.sort_values('Data', ascending=True)
+
+    # Există un singur curs pe (Data, Cod), deci nu e nevoie de agregarea din pivot_table
+    pivot_df = df_filtered.pivot(
+        index='Data', columns='Cod', values='Curs'
+    ).reset_index()
+    pivot_df = pivot_df.sort_values('Data', ascending=False)
+
+    # pyarrow scrie CSV-ul direct în bytes, fără writer-ul Python și re-encodarea UTF-8
+    buf = pa.BufferOutputStream()
+    # Datele rămân datetime în tabel; formatul dd.mm.yyyy se aplică doar în CSV
+    csv_df = pivot_df.assign(Data=pivot_df['Data'].dt.strftime('%d.%m.%Y'))
+    pacsv.write_csv(pa.Table.from_pandas(csv_df, preserve_index=False), buf)
+    csv = buf.getvalue().to_pybytes()
+    return df_filtered, pivot_df, csv
+
+@st.cache_data(max_entries=64)
+def make_rates_figure(_df_filtered, days, currencies, period_label, version):
+    """Construiește graficul evoluției cursului și îl întoarce ca JSON (cache per selecție)."""
+    df_filtered = _df_filtered
+    fig = px.line(
+        df_filtered,
+        x='Data',
+        y='Curs',
+        color='Cod',
+        title=f'Evoluția cursului valutar — {period_label}',
+        labels={'Data': 'Data', 'Curs': 'Curs (MDL)', 'Cod': 'Moneda'},
+        markers=True
+    )
+    fig.update_layout(
+        hovermode='x unified',
+        xaxis=dict(tickformat='%d.%m.%Y', tickmode='auto', nticks=10),
+        legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1),
+        plot_bgcolor='white',
+        paper_bgcolor='white',
+        font=dict(family='Inter, Arial'),
+    )
+    fig.update_yaxes(gridcolor='#f1f5f9')
+    fig.update_xaxes(showgrid=False)
+    fig.update_traces(mode='lines+markers')
+    return pio.to_json(fig)
 
 # ─────────────────────────────────────────────
 # FUNCȚII CAPITAL BANCAR
@@ -928,60 +1165,50 @@ with tab_cursuri:
 
     if st.sidebar.button("🔄 Reîncarcă datele"):
         st.cache_data.clear()
+        # Altfel get_historical_data ar reciti același snapshot Parquet
+        try:
+            os.remove(_rates_snapshot_path(datetime.now(), days))
+        except FileNotFoundError:
+            pass
         st.rerun()
 
     with st.spinner('Se încarcă datele de la BNM...'):
         df = get_historical_data(days)
 
     if not df.empty and selected_currencies:
-        df_filtered = df[df['Cod'].isin(selected_currencies)].copy()
-        df_filtered = df_filtered.sort_values('Data', ascending=True)
+        currencies_key = tuple(sorted(selected_currencies))
+        data_version = df.attrs.get('version')
+        df_filtered, pivot_df, csv = filter_and_pivot(
+            df, days, currencies_key, data_version
+        )
 
         latest_date = df_filtered['Data'].max()
         st.markdown(f"### 💰 Cursul valutar din {latest_date.strftime('%d.%m.%Y')}")
-        latest_rates = df_filtered[df_filtered['Data'] == latest_date]
+        latest_rates = df_filtered.loc[
+            df_filtered['Data'] == latest_date, ['Cod', 'Curs']
+        ].set_index('Cod')['Curs']
 
         cols = st.columns(len(selected_currencies))
         for i, currency in enumerate(selected_currencies):
-            rate_data = latest_rates[latest_rates['Cod'] == currency]
-            if not rate_data.empty:
-                rate = rate_data['Curs'].values[0]
-                cols[i].metric(label=currency, value=f"{rate:.4f} MDL")
+            if currency in latest_rates.index:
+                cols[i].metric(label=currency, value=f"{latest_rates[currency]:.4f} MDL")
 
         st.markdown("---")
         st.markdown("### 📈 Evoluția cursului valutar")
 
-        fig = px.line(
-            df_filtered,
-            x='Data',
-            y='Curs',
-            color='Cod',
-            title=f'Evoluția cursului valutar — {selected_period}',
-            labels={'Data': 'Data', 'Curs': 'Curs (MDL)', 'Cod': 'Moneda'},
-            markers=True
-        )
-        fig.update_layout(
-            hovermode='x unified',
-            xaxis=dict(tickformat='%d.%m.%Y', tickmode='auto', nticks=10),
-            legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1),
-            plot_bgcolor='white',
-            paper_bgcolor='white',
-            font=dict(family='Inter, Arial'),
-        )
-        fig.update_yaxes(gridcolor='#f1f5f9')
-        fig.update_xaxes(showgrid=False)
-        fig.update_traces(mode='lines+markers')
+        fig = pio.from_json(make_rates_figure(
+            df_filtered, days, currencies_key, selected_period, data_version
+        ))
         st.plotly_chart(fig, use_container_width=True)
 
         st.markdown("### 📋 Tabel cu date")
-        pivot_df = df_filtered.pivot_table(
-            index='Data', columns='Cod', values='Curs'
-        ).reset_index()
-        pivot_df['Data'] = pivot_df['Data'].dt.strftime('%d.%m.%Y')
-        pivot_df = pivot_df.sort_values('Data', ascending=False)
-        st.dataframe(pivot_df, width='stretch', hide_index=True)
-
-        csv = pivot_df.to_csv(index=False).encode('utf-8')
+        st.dataframe(
+            pivot_df,
+            width='stretch',
+            hide_index=True,
+            column_config={'Data': st.column_config.DateColumn(format='DD.MM.YYYY')}
+        )
+
         st.download_button(
             label="📥 Descarcă CSV",
             data=csv,